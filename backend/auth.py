@@ -1,24 +1,44 @@
-from datetime import datetime, timedelta
+import time
+from datetime import timedelta
 from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from sqlalchemy.orm import Session
 from . import models, schemas
+from .jwt_fast import decode_hs256, encode_hs256, encode_hs256_subject
 
 # Security configuration
 SECRET_KEY = "your-secret-key-change-this-in-production"  # TODO: Move to environment variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REMEMBER_ME_EXPIRE_MINUTES = 43200  # 30 days
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Token lifetimes in seconds, added directly to the integer issue time
+_EXP_DEFAULT = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+_EXP_REMEMBER = REMEMBER_ME_EXPIRE_MINUTES * 60
+
+_SECRET_KEY_BYTES = SECRET_KEY.encode()
+
+# Single Argon2id hasher shared by all requests (OWASP recommended parameters)
+_ph = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# Verified against when the user does not exist so both login paths cost one Argon2 run
+_DUMMY_HASH = _ph.hash("dummy-password")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against a hashed password."""
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return _ph.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
 
 def get_password_hash(password: str) -> str:
     """Hash a password."""
-    return pwd_context.hash(password)
+    return _ph.hash(password)
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check whether a stored hash was created with outdated parameters."""
+    return _ph.check_needs_rehash(hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, remember_me: bool = False) -> str:
     """Create a JWT access token.
@@ -28,18 +48,33 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, r
         expires_delta: Optional custom expiration time
         remember_me: If True, use extended 30-day expiration
     """
-    to_encode = data.copy()
+    now = int(time.time())
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + int(expires_delta.total_seconds())
     elif remember_me:
         # Extended expiration for "Remember Me" - 30 days
-        expire = datetime.utcnow() + timedelta(minutes=43200)  # 30 days = 43200 minutes
+        expire = now + _EXP_REMEMBER
     else:
         # Default short expiration - 30 minutes
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+        expire = now + _EXP_DEFAULT
+
+    # Fast path for the usual {"sub": username} payload
+    if data.keys() == {"sub"} and isinstance(data["sub"], str):
+        token = encode_hs256_subject(data["sub"], expire, _SECRET_KEY_BYTES)
+        if token is not None:
+            return token
+
+    to_encode = data.copy()
+    to_encode["exp"] = expire
+    return encode_hs256(to_encode, _SECRET_KEY_BYTES)
+
+def decode_access_token(token: str) -> dict:
+    """Verify a JWT access token and return its claims.
+
+    Raises:
+        InvalidTokenError: If the token is malformed, forged or expired
+    """
+    return decode_hs256(token, _SECRET_KEY_BYTES)
 
 def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     """Get a user by username."""
@@ -65,8 +100,12 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.User:
 def authenticate_user(db: Session, username: str, password: str) -> Optional[models.User]:
     """Authenticate a user by username and password."""
     user = get_user_by_username(db, username)
-    if not user:
-        return None
-    if not verify_password(password, user.hashed_password):
+    # Always run the KDF so unknown usernames can't be told apart by response time
+    password_ok = verify_password(password, user.hashed_password if user else _DUMMY_HASH)
+    if not user or not password_ok:
         return None
+    # Migrate hashes created with older parameters (e.g. passlib defaults)
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = get_password_hash(password)
+        db.commit()
     return user
@@ -1,12 +1,35 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./streamflow.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # SQLite keeps the default pool: it allows one writer at a time, so more
+    # connections only turn queueing into "database is locked" errors
+    engine_options = {"connect_args": {"check_same_thread": False}}
+else:
+    # Size the pool for the threadpool sync routes run in, so requests don't queue for a connection
+    engine_options = {"pool_size": 20, "max_overflow": 40}
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# For endpoints that only read: the connections themselves refuse writes
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    read_engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options)
+
+    @event.listens_for(read_engine, "connect")
+    def _set_query_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+elif SQLALCHEMY_DATABASE_URL.startswith("postgresql"):
+    read_engine = engine.execution_options(postgresql_readonly=True)
+else:
+    # No portable read-only switch; the session only separates read from write use
+    read_engine = engine
+
+SessionLocalRO = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
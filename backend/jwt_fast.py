@@ -0,0 +1,89 @@
+"""
+Minimal HS256 JSON Web Token codec
+Avoids the per-call header parsing and option handling done by general JWT libraries
+"""
+
+import hmac
+import re
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import sha256
+
+import orjson
+
+
+# Every token we issue shares this header, so its encoded segment is built once
+_HS256_HEADER_B64 = urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+
+
+# Strings matching this need no escaping inside a JSON string literal
+_JSON_SAFE_RE = re.compile(r'[^"\\\x00-\x1f\x7f]*')
+
+
+class InvalidTokenError(ValueError):
+    """Raised when a token is malformed, has a bad signature or has expired."""
+
+
+def _b64encode(data: bytes) -> bytes:
+    """Encode bytes as base64url without padding."""
+    return urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(segment: str) -> bytes:
+    """Decode a base64url segment with its padding stripped."""
+    return urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def encode_hs256(claims: dict, key: bytes) -> str:
+    """Serialize `claims` and sign them with HMAC-SHA256 using `key`."""
+    signing_input = _HS256_HEADER_B64 + b"." + _b64encode(orjson.dumps(claims))
+    signature = _b64encode(hmac.new(key, signing_input, sha256).digest())
+    return (signing_input + b"." + signature).decode()
+
+
+def encode_hs256_subject(sub: str, exp: int, key: bytes) -> str | None:
+    """
+    Sign the common {"sub", "exp"} claim set without building or serializing a dict.
+
+    Produces the same token as encode_hs256({"sub": sub, "exp": exp}, key).
+    Returns None when `sub` would need JSON escaping, so callers fall back
+    to the generic encoder.
+    """
+    if not _JSON_SAFE_RE.fullmatch(sub):
+        return None
+    payload = b'{"sub":"' + sub.encode() + b'","exp":' + str(exp).encode() + b"}"
+    signing_input = _HS256_HEADER_B64 + b"." + _b64encode(payload)
+    signature = _b64encode(hmac.new(key, signing_input, sha256).digest())
+    return (signing_input + b"." + signature).decode()
+
+
+def decode_hs256(token: str, key: bytes) -> dict:
+    """
+    Verify an HS256 token signed with `key` and return its claims.
+
+    The header is not parsed: only tokens signed with our own key pass the
+    signature check, and we only ever issue HS256 tokens.
+    """
+    try:
+        signing_input, _, signature = token.encode("ascii").rpartition(b".")
+        header, _, payload = signing_input.partition(b".")
+        if not header or not payload:
+            raise InvalidTokenError("Malformed token")
+        expected = hmac.new(key, signing_input, sha256).digest()
+        if not hmac.compare_digest(_b64decode(signature.decode()), expected):
+            raise InvalidTokenError("Signature verification failed")
+        claims = orjson.loads(_b64decode(payload.decode()))
+    except ValueError as e:
+        if isinstance(e, InvalidTokenError):
+            raise
+        raise InvalidTokenError("Malformed token") from e
+
+    if not isinstance(claims, dict):
+        raise InvalidTokenError("Invalid claims")
+    exp = claims.get("exp")
+    if exp is not None:
+        if not isinstance(exp, (int, float)):
+            raise InvalidTokenError("Invalid exp claim")
+        if exp <= time.time():
+            raise InvalidTokenError("Token has expired")
+    return claims
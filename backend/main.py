@@ -1,21 +1,52 @@
-from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, status
-from fastapi.responses import FileResponse
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+import asyncio
+import mimetypes
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import timedelta
-from jose import JWTError, jwt
-
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.orm import Session
 
 from . import models, schemas, scan_music, auth
-from .database import SessionLocal, engine
+from .models import user_favorites
+from .jwt_fast import InvalidTokenError
+from .database import SessionLocal, SessionLocalRO, engine
 from .recommendations import RecommendationEngine, get_user_listening_stats
 
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+# create_all() skips tables that already exist, so add any indexes introduced since
+for table in (models.PlayHistory.__table__, models.Skip.__table__):
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+# Single-column indexes now covered by the composite ones above
+_SUPERSEDED_INDEXES = ("ix_play_history_user_id", "ix_play_history_played_at", "ix_skips_user_id")
+with engine.begin() as conn:
+    for index_name in _SUPERSEDED_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+# Takes the session per call, so one engine (and its short-lived caches) serves every request
+rec_engine = RecommendationEngine()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    _scan_executor.shutdown(wait=False, cancel_futures=True)
+
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -41,38 +72,140 @@ def get_db():
         db.close()
 
 
+def get_db_ro():
+    db = SessionLocalRO()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _insert_returning(db: Session, model, **values):
+    """
+    INSERT a row and read back all of its columns in the same statement.
+    Returns a plain Row, which is unaffected by expire-on-commit.
+    """
+    stmt = insert(model).values(**values).returning(*model.__table__.columns)
+    return db.execute(stmt).one()
+
+
+# Scans run in a separate process so metadata parsing never stalls request handling
+# Spawned, not forked: forking from a threaded server can copy locks held by other threads
+_scan_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+# The running (or last) scan; a new scan may start once it is done
+_scan_future: asyncio.Future | None = None
+
+
+def _report_scan_result(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Music library scan failed: {future.exception()}")
+
+
 @app.post("/api/scan-music")
-async def scan_music_endpoint(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def scan_music_endpoint():
     """
     Starts a background task to scan the music library.
+    Only one scan runs at a time; repeated requests while it runs are ignored.
     """
-    background_tasks.add_task(scan_music.scan_music_library, db)
+    global _scan_future
+    # No await between the check and the update, so this is atomic on the event loop
+    if _scan_future is not None and not _scan_future.done():
+        return {"message": "Music library scan already in progress."}
+    _scan_future = asyncio.get_running_loop().run_in_executor(_scan_executor, scan_music.run_scan)
+    _scan_future.add_done_callback(_report_scan_result)
     return {"message": "Music library scan started in the background."}
 
 
+STREAM_CHUNK_SIZE = 64 * 1024
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def _parse_range(range_header: str, file_size: int) -> tuple[int, int] | None:
+    """
+    Parse a single-range `Range` header into an inclusive (start, end) pair.
+    Returns None for headers we don't handle (e.g. multiple ranges) so the
+    whole file is served instead.
+    """
+    match = _RANGE_RE.fullmatch(range_header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+
+    start, end = match.group(1), match.group(2)
+    if start == "":
+        # Suffix range: the last N bytes
+        start, end = max(file_size - int(end), 0), file_size - 1
+    else:
+        start = int(start)
+        if end and int(end) < start:
+            return None  # Syntactically invalid, ignored per RFC 7233
+        end = min(int(end), file_size - 1) if end else file_size - 1
+
+    if start >= file_size or start > end:
+        raise HTTPException(
+            status_code=416,
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+    return start, end
+
+
+def _iter_file_range(path: str, start: int, length: int):
+    """Yield `length` bytes of a file starting at `start`, in fixed-size chunks."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
 @app.get("/api/stream/{song_id}")
-async def stream_song(song_id: int, db: Session = Depends(get_db)):
+async def stream_song(song_id: int, request: Request, db: Session = Depends(get_db_ro)):
     """
     Streams the audio file for a given song.
+    Supports single HTTP Range requests so clients can seek without
+    downloading the whole file.
     """
-    song = db.query(models.Song).filter(models.Song.id == song_id).first()
+    song = db.get(models.Song, song_id)
     if not song:
         raise HTTPException(status_code=404, detail="Song not found")
-    
-    return FileResponse(song.file_path)
+
+    try:
+        file_size = os.stat(song.file_path).st_size
+    except OSError:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+
+    range_header = request.headers.get("range")
+    byte_range = _parse_range(range_header, file_size) if range_header else None
+    if byte_range is None:
+        return FileResponse(song.file_path, headers={"Accept-Ranges": "bytes"})
+
+    start, end = byte_range
+    length = end - start + 1
+    media_type = mimetypes.guess_type(song.file_path)[0] or "audio/mpeg"
+    return StreamingResponse(
+        _iter_file_range(song.file_path, start, length),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers={
+            "Accept-Ranges": "bytes",
+            "Content-Range": f"bytes {start}-{end}/{file_size}",
+            "Content-Length": str(length),
+        },
+    )
 
 
 @app.post("/api/songs/", response_model=schemas.Song)
 def create_song(song: schemas.SongCreate, db: Session = Depends(get_db)):
-    db_song = models.Song(**song.dict())
-    db.add(db_song)
+    db_song = _insert_returning(db, models.Song, **song.dict())
     db.commit()
-    db.refresh(db_song)
     return db_song
 
 
 @app.get("/api/songs/", response_model=list[schemas.Song])
-def read_songs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_songs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db_ro)):
     songs = db.query(models.Song).offset(skip).limit(limit).all()
     return songs
 
@@ -174,60 +307,139 @@ def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db)):
     }
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+@dataclass(frozen=True)
+class CurrentUser:
+    """Detached snapshot of the authenticated user, safe to share across sessions."""
+    id: int
+    username: str
+    email: str
+    created_at: datetime
+
+
+USER_CACHE_TTL_SECONDS = 30
+USER_CACHE_MAX_SIZE = 4096
+
+# Authenticated users keyed by raw token, as (user, valid_until) pairs.
+# The dict is never mutated: writers publish a new copy under the lock,
+# so readers can look tokens up without taking it.
+_user_cache: dict[str, tuple[CurrentUser, float]] = {}
+_user_cache_lock = threading.Lock()
+
+
+def _cache_user(token: str, user: CurrentUser, valid_until: float) -> None:
+    """Publish a new snapshot of the user cache with `token` added."""
+    global _user_cache
+    with _user_cache_lock:
+        now = time.time()
+        cache = {k: v for k, v in _user_cache.items() if v[1] > now}
+        # Dicts keep insertion order, so the oldest entries come first
+        overflow = len(cache) - USER_CACHE_MAX_SIZE + 1
+        if overflow > 0:
+            for stale in list(cache)[:overflow]:
+                del cache[stale]
+        cache[token] = (user, valid_until)
+        _user_cache = cache
+
+
+def bearer_token(request: Request) -> str:
+    """Extract the token from an `Authorization: Bearer <token>` header."""
+    authorization = request.headers.get("authorization")
+    if not authorization or authorization[:7].lower() != "bearer ":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return authorization[7:]
+
+
+async def get_current_user(token: str = Depends(bearer_token), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = _user_cache.get(token)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
     try:
-        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+        payload = auth.decode_access_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-    except JWTError:
+    except InvalidTokenError:
         raise credentials_exception
     user = auth.get_user_by_username(db, username=username)
     if user is None:
         raise credentials_exception
-    return user
+    current_user = CurrentUser(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        created_at=user.created_at,
+    )
+    # Never trust a cached entry past the token's own expiry
+    valid_until = min(time.time() + USER_CACHE_TTL_SECONDS, payload.get("exp", 0))
+    _cache_user(token, current_user, valid_until)
+    return current_user
+
+def _song_exists(db: Session, song_id: int) -> bool:
+    """Check that a song exists without loading the row."""
+    return db.execute(select(1).where(models.Song.id == song_id)).scalar() is not None
+
+def _is_favorite(db: Session, user_id: int, song_id: int) -> bool:
+    """Check a single (user, song) pair without loading the whole favorites collection."""
+    row = db.execute(
+        select(user_favorites.c.song_id).where(
+            user_favorites.c.user_id == user_id,
+            user_favorites.c.song_id == song_id,
+        )
+    ).first()
+    return row is not None
 
 @app.post("/api/favorites/{song_id}")
-def add_to_favorites(song_id: int, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    song = db.query(models.Song).filter(models.Song.id == song_id).first()
-    if not song:
+def add_to_favorites(song_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    if not _song_exists(db, song_id):
         raise HTTPException(status_code=404, detail="Song not found")
     
-    if song in current_user.favorites:
+    if _is_favorite(db, current_user.id, song_id):
         raise HTTPException(status_code=400, detail="Song already in favorites")
     
-    current_user.favorites.append(song)
+    db.execute(user_favorites.insert().values(user_id=current_user.id, song_id=song_id))
     db.commit()
     return {"message": "Song added to favorites"}
 
 @app.delete("/api/favorites/{song_id}")
-def remove_from_favorites(song_id: int, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    song = db.query(models.Song).filter(models.Song.id == song_id).first()
-    if not song:
+def remove_from_favorites(song_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    if not _song_exists(db, song_id):
         raise HTTPException(status_code=404, detail="Song not found")
     
-    if song not in current_user.favorites:
+    if not _is_favorite(db, current_user.id, song_id):
         raise HTTPException(status_code=400, detail="Song not in favorites")
     
-    current_user.favorites.remove(song)
+    db.execute(
+        user_favorites.delete().where(
+            user_favorites.c.user_id == current_user.id,
+            user_favorites.c.song_id == song_id,
+        )
+    )
     db.commit()
     return {"message": "Song removed from favorites"}
 
 @app.get("/api/favorites", response_model=list[schemas.Song])
-def get_favorites(current_user: models.User = Depends(get_current_user)):
-    return current_user.favorites
+def get_favorites(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    return db.execute(
+        select(models.Song)
+        .join(user_favorites, user_favorites.c.song_id == models.Song.id)
+        .where(user_favorites.c.user_id == current_user.id)
+    ).scalars().all()
 
 
 # Play History and Analytics endpoints
 @app.post("/api/play-history", response_model=schemas.PlayHistory)
 def log_play_history(
     play_data: schemas.PlayHistoryCreate,
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -235,76 +447,91 @@ def log_play_history(
     Called when user plays a song (on start and completion).
     """
     # Verify song exists
-    song = db.query(models.Song).filter(models.Song.id == play_data.song_id).first()
-    if not song:
+    if not _song_exists(db, play_data.song_id):
         raise HTTPException(status_code=404, detail="Song not found")
     
     # Create play history entry
-    play_history = models.PlayHistory(
+    play_history = _insert_returning(
+        db,
+        models.PlayHistory,
         user_id=current_user.id,
         song_id=play_data.song_id,
         listen_duration=play_data.listen_duration,
         completion_rate=play_data.completion_rate,
         completed=play_data.completed
     )
-    db.add(play_history)
     
     # Increment song play count if completed
     if play_data.completed:
-        song.play_count = (song.play_count or 0) + 1
+        db.execute(
+            update(models.Song)
+            .where(models.Song.id == play_data.song_id)
+            .values(play_count=func.coalesce(models.Song.play_count, 0) + 1)
+        )
     
     db.commit()
-    db.refresh(play_history)
+    rec_engine.invalidate_play_caches(current_user.id)
     return play_history
 
 
 @app.post("/api/skips", response_model=schemas.Skip)
 def log_skip(
     skip_data: schemas.SkipCreate,
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Log when user skips a song.
     """
     # Verify song exists
-    song = db.query(models.Song).filter(models.Song.id == skip_data.song_id).first()
-    if not song:
+    if not _song_exists(db, skip_data.song_id):
         raise HTTPException(status_code=404, detail="Song not found")
     
     # Create skip entry
-    skip = models.Skip(
+    skip = _insert_returning(
+        db,
+        models.Skip,
         user_id=current_user.id,
         song_id=skip_data.song_id,
         time_before_skip=skip_data.time_before_skip
     )
-    db.add(skip)
     
     # Increment skip count
-    song.skip_count = (song.skip_count or 0) + 1
+    db.execute(
+        update(models.Song)
+        .where(models.Song.id == skip_data.song_id)
+        .values(skip_count=func.coalesce(models.Song.skip_count, 0) + 1)
+    )
     
     db.commit()
-    db.refresh(skip)
     return skip
 
 
+# Response fields of schemas.Song, read straight off trusted ORM rows
+_SONG_FIELDS = tuple(schemas.Song.model_fields)
+
+
+def _song_to_dict(song: models.Song) -> dict:
+    """Serialize a Song row with the schemas.Song shape, skipping pydantic validation."""
+    return {field: getattr(song, field) for field in _SONG_FIELDS}
+
+
 @app.get("/api/recommendations")
 def get_recommendations(
     limit: int = 10,
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Get personalized song recommendations for the current user.
     """
-    engine = RecommendationEngine(db)
-    recommendations = engine.get_recommendations(current_user.id, limit=limit)
+    recommendations = rec_engine.get_recommendations(db, current_user.id, limit=limit)
     
     # Convert to response format
     result = []
     for song, score, reason in recommendations:
         result.append({
-            "song": schemas.Song.from_orm(song),
+            "song": _song_to_dict(song),
             "score": round(score, 3),
             "reason": reason
         })
@@ -319,19 +546,18 @@ def get_recommendations(
 def get_similar_songs(
     song_id: int,
     limit: int = 10,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_ro)
 ):
     """
     Get songs similar to a specific song (content-based).
     No authentication required.
     """
-    engine = RecommendationEngine(db)
-    similar_songs = engine.get_similar_songs(song_id, limit=limit)
+    similar_songs = rec_engine.get_similar_songs(db, song_id, limit=limit)
     
     result = []
     for song, score, reason in similar_songs:
         result.append({
-            "song": schemas.Song.from_orm(song),
+            "song": _song_to_dict(song),
             "score": round(score, 3),
             "reason": reason
         })
@@ -342,28 +568,45 @@ def get_similar_songs(
     }
 
 
+TRENDING_CACHE_TTL_SECONDS = 60
+TRENDING_CACHE_MAX_SIZE = 256
+
+# Serialized trending responses keyed by (limit, days), as (created_at, body) pairs
+_trending_cache: dict[tuple[int, int], tuple[float, bytes]] = {}
+
+
 @app.get("/api/trending")
 def get_trending(
     limit: int = 20,
     days: int = 7,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_ro)
 ):
     """
     Get trending songs based on recent plays.
     No authentication required.
+    Responses are cached for a minute; trending is approximate anyway.
     """
-    engine = RecommendationEngine(db)
-    trending_songs = engine.get_trending_songs(limit=limit, days=days)
+    key = (limit, days)
+    now = time.monotonic()
+    cached = _trending_cache.get(key)
+    if cached is not None and now - cached[0] < TRENDING_CACHE_TTL_SECONDS:
+        return Response(cached[1], media_type="application/json")
+
+    trending_songs = rec_engine.get_trending_songs(db, limit=limit, days=days)
     
-    return {
-        "songs": [schemas.Song.from_orm(song) for song in trending_songs],
+    body = orjson.dumps({
+        "songs": [_song_to_dict(song) for song in trending_songs],
         "total": len(trending_songs)
-    }
+    })
+    if len(_trending_cache) >= TRENDING_CACHE_MAX_SIZE:
+        _trending_cache.clear()
+    _trending_cache[key] = (now, body)
+    return Response(body, media_type="application/json")
 
 
 @app.get("/api/listening-stats")
 def get_listening_stats(
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table, Float, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table, Float, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -48,7 +48,8 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    favorites = relationship("Song", secondary=user_favorites, backref="favorited_by")
+    # Query user_favorites directly; loading the whole collection is never needed
+    favorites = relationship("Song", secondary=user_favorites, backref="favorited_by", lazy="raise")
     play_history = relationship("PlayHistory", back_populates="user", cascade="all, delete-orphan")
     skips = relationship("Skip", back_populates="user", cascade="all, delete-orphan")
 
@@ -56,11 +57,17 @@ class User(Base):
 class PlayHistory(Base):
     """Track user listening history for recommendation algorithm"""
     __tablename__ = "play_history"
+    __table_args__ = (
+        # Per-user history filtered/ordered by time (recommendations, recently played)
+        Index("ix_play_history_user_id_played_at", "user_id", "played_at"),
+        # Time-windowed aggregation grouped by song (trending)
+        Index("ix_play_history_played_at_song_id", "played_at", "song_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     song_id = Column(Integer, ForeignKey("songs.id"), nullable=False, index=True)
-    played_at = Column(DateTime, default=datetime.utcnow, index=True)
+    played_at = Column(DateTime, default=datetime.utcnow)
     listen_duration = Column(Integer)  # Seconds listened
     completion_rate = Column(Float)  # Percentage of song completed (0-1)
     completed = Column(Boolean, default=False)  # True if >80% listened
@@ -72,9 +79,13 @@ class PlayHistory(Base):
 class Skip(Base):
     """Track when users skip songs to understand preferences"""
     __tablename__ = "skips"
+    __table_args__ = (
+        Index("ix_skips_user_id_skipped_at", "user_id", "skipped_at"),
+        Index("ix_skips_skipped_at_song_id", "skipped_at", "song_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     song_id = Column(Integer, ForeignKey("songs.id"), nullable=False, index=True)
     skipped_at = Column(DateTime, default=datetime.utcnow)
     time_before_skip = Column(Integer)  # Seconds before skipping
@@ -4,11 +4,20 @@ Implements hybrid recommendation system with content-based and collaborative fil
 """
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, or_
 from typing import List, Tuple, Dict, Optional
 from datetime import datetime, timedelta
-from collections import Counter, defaultdict
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+import heapq
+import time
 import numpy as np
+from scipy.sparse import coo_matrix
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the NumPy path is used without it
+    njit = None
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import StandardScaler
 
@@ -16,20 +25,185 @@ from .models import Song, User, PlayHistory, Skip
 from . import schemas
 
 
+@lru_cache(maxsize=65536)
+def _norm(value: Optional[str]) -> Optional[str]:
+    """Case- and whitespace-normalized artist/genre/album name, memoized."""
+    return value.lower().strip() if value is not None else None
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> List[int]:
+    """
+    Indices of the k highest scores, best first (ties keep candidate order).
+    Uses a partial partition instead of sorting every candidate.
+    """
+    if k <= 0:
+        return []
+    if k < len(scores):
+        # Partition to find the k-th best score, then break ties at that
+        # boundary by candidate order so results match a stable sort
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        candidates = np.concatenate((above, ties))
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order].tolist()
+
+
+# Audio features compared between songs: (attribute, similarity range, weight)
+_AUDIO_FEATURES = (
+    ("bpm", 40.0, 1.0),  # Songs within 40 BPM are similar
+    ("year", 10.0, 0.6),  # Era matching, lower weight
+    ("duration", 300.0, 0.4),  # 5 min range, even lower weight
+    ("energy", 1.0, 1.0),
+    ("danceability", 1.0, 1.0),
+    ("valence", 1.0, 1.0),
+    ("acousticness", 1.0, 1.0),
+)
+_BPM, _YEAR, _ENERGY = 0, 1, 3
+_AUDIO_SCALES = np.array([scale for _, scale, _ in _AUDIO_FEATURES], dtype=np.float32)
+_AUDIO_WEIGHTS = np.array([weight for _, _, weight in _AUDIO_FEATURES], dtype=np.float32)
+
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+# Short-lived caches for the per-request recommendation inputs
+RECENT_PLAYS_CACHE_TTL_SECONDS = 60
+RECENT_PLAYS_CACHE_MAX_SIZE = 10000
+MAX_PLAYS_CACHE_TTL_SECONDS = 60
+
+# Best similar-song score reachable by audio features alone (20% weight)
+_MAX_AUDIO_ONLY_SIMILARITY = 0.20
+
+# Upper bound on candidate x reference x feature values compared in one NumPy pass
+_SIMILARITY_BLOCK_VALUES = 1 << 22
+
+
+def _audio_feature_matrix(songs: List[Song]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack the songs' audio features into an (n_songs, n_features) float32 matrix.
+    Also returns a mask of usable values; missing or zero values are
+    treated as unavailable.
+    """
+    values = np.array(
+        [[getattr(song, name) or 0.0 for name, _, _ in _AUDIO_FEATURES] for song in songs],
+        dtype=np.float64,
+    ).reshape(len(songs), len(_AUDIO_FEATURES))
+    # float32 halves the bytes the similarity pass moves; the mask is taken
+    # before the cast so tiny values don't round to "missing"
+    return values.astype(np.float32), values != 0
+
+
+if njit is not None:
+    # Serial on purpose: requests already run in parallel on the server's threadpool,
+    # and numba's fallback threading layer aborts on concurrent parallel calls
+    @njit(cache=True)
+    def _audio_similarity_kernel(cand_values, cand_mask, ref_values, ref_mask, scales, weights, out):
+        """Compiled loop version of _batch_audio_similarity."""
+        n_ref, n_features = ref_values.shape
+        for i in range(cand_values.shape[0]):
+            out[i] = 0.5
+            # If no features available, keep the neutral score
+            if not (cand_mask[i, _BPM] or cand_mask[i, _ENERGY] or cand_mask[i, _YEAR]):
+                continue
+            total = 0.0
+            n_compared = 0
+            for j in range(n_ref):
+                component_sum = 0.0
+                component_count = 0
+                for f in range(n_features):
+                    if cand_mask[i, f] and ref_mask[j, f]:
+                        similarity = 1.0 - abs(cand_values[i, f] - ref_values[j, f]) / scales[f]
+                        component_sum += max(0.0, similarity) * weights[f]
+                        component_count += 1
+                if component_count > 0:
+                    total += component_sum / component_count
+                    n_compared += 1
+            if n_compared > 0:
+                out[i] = total / n_compared
+
+
+def _batch_audio_similarity(
+    cand_values: np.ndarray,
+    cand_mask: np.ndarray,
+    ref_values: np.ndarray,
+    ref_mask: np.ndarray,
+) -> np.ndarray:
+    """
+    Audio similarity of every candidate to a set of reference songs.
+
+    For each (candidate, reference) pair the available feature similarities
+    are averaged; a candidate's score is the mean over references sharing
+    at least one feature with it, or 0.5 when none do. Candidates without
+    bpm, energy or year always get the neutral 0.5.
+    """
+    n_cand, n_ref = len(cand_values), len(ref_values)
+    scores = np.full(n_cand, 0.5)
+    if n_ref == 0:
+        return scores
+    if njit is not None:
+        _audio_similarity_kernel(
+            cand_values, cand_mask, ref_values, ref_mask, _AUDIO_SCALES, _AUDIO_WEIGHTS, scores
+        )
+        return scores
+
+    block = max(1, _SIMILARITY_BLOCK_VALUES // (n_ref * len(_AUDIO_FEATURES)))
+    for start in range(0, n_cand, block):
+        values = cand_values[start:start + block]
+        mask = cand_mask[start:start + block]
+        # All features at once: (candidates, references, features)
+        valid = mask[:, None, :] & ref_mask[None, :, :]
+        diff = np.abs(values[:, None, :] - ref_values[None, :, :])
+        similarity = np.maximum(0.0, 1.0 - diff / _AUDIO_SCALES) * _AUDIO_WEIGHTS
+        component_sum = np.where(valid, similarity, 0.0).sum(axis=2)
+        component_count = valid.sum(axis=2)
+
+        compared = component_count > 0
+        per_reference = np.divide(
+            component_sum, component_count, out=np.zeros_like(component_sum), where=compared
+        )
+        n_compared = compared.sum(axis=1)
+        np.divide(
+            per_reference.sum(axis=1), n_compared,
+            out=scores[start:start + block], where=n_compared > 0,
+        )
+
+    # If no features available, return neutral score
+    has_features = cand_mask[:, _BPM] | cand_mask[:, _ENERGY] | cand_mask[:, _YEAR]
+    scores[~has_features] = 0.5
+    return scores
+
+
+@dataclass
+class ReasonContext:
+    """Summary of the user's recent completed plays, used to explain recommendations."""
+    artist_counts: Counter
+    genre_counts: Counter
+    album_set: set
+    avg_bpm: Optional[float]
+
+
 class RecommendationEngine:
     """
     Hybrid recommendation system combining:
     - Content-based filtering (60%): Genre, artist, audio features similarity
     - Collaborative filtering (40%): Co-occurrence patterns from play history
+    
+    The engine holds no per-request state, so a single instance is shared by
+    all requests and each call is given the session to query.
     """
     
-    def __init__(self, db: Session):
-        self.db = db
+    def __init__(self):
         self.content_weight = 0.6
         self.collaborative_weight = 0.4
+        # user_id -> (created_at, window hours, recently played song ids)
+        self._recent_plays_cache: Dict[int, Tuple[float, int, frozenset]] = {}
+        # (created_at, max play count)
+        self._max_plays_cache: Optional[Tuple[float, int]] = None
     
     def get_recommendations(
         self, 
+        db: Session,
         user_id: int, 
         limit: int = 10,
         exclude_recently_played_hours: int = 24
@@ -40,56 +214,55 @@ class RecommendationEngine:
         Returns:
             List of tuples (song, score, reason)
         """
-        user = self.db.query(User).filter(User.id == user_id).first()
+        user = db.get(User, user_id)
         if not user:
             return []
         
         # Get user's listening history
-        recent_cutoff = datetime.utcnow() - timedelta(hours=exclude_recently_played_hours)
-        recently_played_ids = {
-            ph.song_id for ph in 
-            self.db.query(PlayHistory)
-            .filter(PlayHistory.user_id == user_id, PlayHistory.played_at >= recent_cutoff)
-            .all()
-        }
+        recently_played_ids = self._get_recently_played_ids(db, user_id, exclude_recently_played_hours)
         
         # Get all songs excluding recently played
-        all_songs = self.db.query(Song).filter(~Song.id.in_(recently_played_ids)).all()
+        all_songs = db.query(Song).filter(~Song.id.in_(recently_played_ids)).all()
         if not all_songs:
             return []
         
+        # Highest play count, shared by the cold-start and popularity scores
+        max_plays = self._get_max_plays(db)
+        
         # Calculate content-based scores
-        content_scores = self._content_based_filtering(user_id, all_songs)
+        content_scores = self._content_based_filtering(db, user_id, all_songs, max_plays)
         
         # Calculate collaborative scores
-        collaborative_scores = self._collaborative_filtering(user_id, all_songs)
-        
-        # Combine scores with weights
-        combined_scores = []
-        for song in all_songs:
-            content_score = content_scores.get(song.id, 0.0)
-            collab_score = collaborative_scores.get(song.id, 0.0)
-            
-            # Weighted combination
-            final_score = (
-                self.content_weight * content_score + 
-                self.collaborative_weight * collab_score
+        collaborative_scores = self._collaborative_filtering(db, user_id, all_songs)
+        
+        # Combine scores with weights, one vector op over all candidates
+        n = len(all_songs)
+        content = np.fromiter((content_scores.get(s.id, 0.0) for s in all_songs), dtype=np.float64, count=n)
+        collab = np.fromiter((collaborative_scores.get(s.id, 0.0) for s in all_songs), dtype=np.float64, count=n)
+        final_scores = self.content_weight * content + self.collaborative_weight * collab
+        
+        # Add popularity boost (10% weight from requirements)
+        popularity = self._calculate_popularity_scores(all_songs, max_plays)
+        final_scores = 0.9 * final_scores + 0.1 * popularity
+        
+        # Only the returned songs need a reason
+        reason_ctx = self._precompute_reason_context(db, user_id)
+        return [
+            (
+                all_songs[i],
+                float(final_scores[i]),
+                self._generate_reason(all_songs[i], float(content[i]), float(collab[i]), reason_ctx),
             )
-            
-            # Add popularity boost (10% weight from requirements)
-            popularity_boost = self._calculate_popularity_score(song)
-            final_score = 0.9 * final_score + 0.1 * popularity_boost
-            
-            # Generate reason
-            reason = self._generate_reason(song, content_score, collab_score, user_id)
-            
-            combined_scores.append((song, final_score, reason))
-        
-        # Sort by score and return top N
-        combined_scores.sort(key=lambda x: x[1], reverse=True)
-        return combined_scores[:limit]
+            for i in _top_k_indices(final_scores, limit)
+        ]
     
-    def _content_based_filtering(self, user_id: int, candidate_songs: List[Song]) -> Dict[int, float]:
+    def _content_based_filtering(
+        self,
+        db: Session,
+        user_id: int,
+        candidate_songs: List[Song],
+        max_plays: Optional[int] = None
+    ) -> Dict[int, float]:
         """
         Calculate content-based similarity scores.
         
@@ -98,31 +271,29 @@ class RecommendationEngine:
         - Artist similarity with partial matching (35%)
         - Audio features similarity when available (20%)
         - Album match (10%)
+        
+        max_plays is reused from the caller when given, saving a query on cold start.
         """
         scores = {}
         
-        # Get user's favorite genres and artists from play history
-        user_play_history = (
-            self.db.query(PlayHistory)
+        # Get the songs the user has completed, in a single joined query
+        played_songs = (
+            db.query(Song)
+            .join(PlayHistory, Song.id == PlayHistory.song_id)
             .filter(PlayHistory.user_id == user_id, PlayHistory.completed == True)
+            .distinct()
+            .order_by(Song.id)
             .all()
         )
         
-        if not user_play_history:
-            # Cold start: return scores based on popularity
-            max_plays = self.db.query(func.max(Song.play_count)).scalar() or 1
-            for song in candidate_songs:
-                # Give new users popular songs
-                popularity = (song.play_count or 0) / max_plays if max_plays > 0 else 0.5
-                scores[song.id] = 0.3 + (0.4 * popularity)  # Range: 0.3 to 0.7
-            return scores
-        
-        # Extract user preferences
-        played_song_ids = [ph.song_id for ph in user_play_history]
-        played_songs = self.db.query(Song).filter(Song.id.in_(played_song_ids)).all()
-        
         if not played_songs:
-            return {song.id: 0.5 for song in candidate_songs}
+            # Cold start: return scores based on popularity
+            if max_plays is None:
+                max_plays = self._get_max_plays(db)
+            # Give new users popular songs, one vector op over all candidates
+            popularity = self._calculate_popularity_scores(candidate_songs, max_plays)
+            cold_start_scores = 0.3 + 0.4 * popularity  # Range: 0.3 to 0.7
+            return dict(zip((song.id for song in candidate_songs), cold_start_scores.tolist()))
         
         # Count favorite genres and artists with weights
         genre_weights = Counter()
@@ -131,52 +302,68 @@ class RecommendationEngine:
         
         for song in played_songs:
             if song.genre:
-                genre_weights[song.genre.lower().strip()] += 1
+                genre_weights[_norm(song.genre)] += 1
             if song.artist:
-                artist_weights[song.artist.lower().strip()] += 1
+                artist_weights[_norm(song.artist)] += 1
             if song.album:
-                album_set.add(song.album.lower().strip())
+                album_set.add(_norm(song.album))
         
         # Get top preferences
         total_plays = len(played_songs)
         favorite_genres = dict(genre_weights.most_common(10))
         favorite_artists = dict(artist_weights.most_common(15))
         
+        # Precompute match scores so each candidate is a dict lookup plus,
+        # at most, one pass over the favorites for partial matches
+        genre_exact = {genre: min(count / total_plays * 2, 1.0) for genre, count in favorite_genres.items()}
+        genre_partial = [
+            (genre, min(count / total_plays * 1.5, 0.7)) for genre, count in favorite_genres.items()
+        ]
+        artist_exact = {artist: min(count / total_plays * 2.5, 1.0) for artist, count in favorite_artists.items()}
+        artist_partial = [
+            (artist, [part for part in artist.split() if len(part) > 3], min(count / total_plays * 1.5, 0.6))
+            for artist, count in favorite_artists.items()
+        ]
+        
+        # Audio features similarity for all candidates in one vectorized pass
+        audio_scores = _batch_audio_similarity(
+            *_audio_feature_matrix(candidate_songs), *_audio_feature_matrix(played_songs)
+        )
+        
         # Calculate scores for each candidate
-        for song in candidate_songs:
+        for song, audio_score in zip(candidate_songs, audio_scores.tolist()):
             # Genre match score (35%) - weighted by frequency
             genre_score = 0.0
             if song.genre:
-                song_genre = song.genre.lower().strip()
-                if song_genre in favorite_genres:
-                    # Weight by how often user plays this genre
-                    genre_score = min(favorite_genres[song_genre] / total_plays * 2, 1.0)
-                else:
+                song_genre = _norm(song.genre)
+                # Weight by how often user plays this genre
+                genre_score = genre_exact.get(song_genre)
+                if genre_score is None:
                     # Partial match for similar genres (e.g., "Rock" matches "Hard Rock")
-                    for fav_genre, count in favorite_genres.items():
-                        if fav_genre in song_genre or song_genre in fav_genre:
-                            genre_score = max(genre_score, min(count / total_plays * 1.5, 0.7))
+                    genre_score = max(
+                        (score for fav_genre, score in genre_partial
+                         if fav_genre in song_genre or song_genre in fav_genre),
+                        default=0.0,
+                    )
             
             # Artist similarity score (35%) - weighted by frequency
             artist_score = 0.0
             if song.artist:
-                song_artist = song.artist.lower().strip()
-                if song_artist in favorite_artists:
-                    # Weight by how often user plays this artist
-                    artist_score = min(favorite_artists[song_artist] / total_plays * 2.5, 1.0)
-                else:
+                song_artist = _norm(song.artist)
+                # Weight by how often user plays this artist
+                artist_score = artist_exact.get(song_artist)
+                if artist_score is None:
                     # Partial match for featuring artists or similar names
-                    for fav_artist, count in favorite_artists.items():
-                        if (fav_artist in song_artist or song_artist in fav_artist or
-                            any(part in song_artist for part in fav_artist.split() if len(part) > 3)):
-                            artist_score = max(artist_score, min(count / total_plays * 1.5, 0.6))
-            
-            # Audio features similarity (20%)
-            audio_score = self._calculate_audio_similarity(song, played_songs)
+                    artist_score = max(
+                        (score for fav_artist, parts, score in artist_partial
+                         if (fav_artist in song_artist or song_artist in fav_artist or
+                             any(part in song_artist for part in parts))),
+                        default=0.0,
+                    )
             
             # Album match bonus (10%)
             album_score = 0.0
-            if song.album and song.album.lower().strip() in album_set:
+            if song.album and _norm(song.album) in album_set:
                 album_score = 0.8
             
             # Combine content factors
@@ -186,7 +373,7 @@ class RecommendationEngine:
         
         return scores
     
-    def _collaborative_filtering(self, user_id: int, candidate_songs: List[Song]) -> Dict[int, float]:
+    def _collaborative_filtering(self, db: Session, user_id: int, candidate_songs: List[Song]) -> Dict[int, float]:
         """
         Calculate collaborative filtering scores based on co-occurrence patterns.
         
@@ -196,7 +383,7 @@ class RecommendationEngine:
         
         # Get user's play history ordered by time
         user_plays = (
-            self.db.query(PlayHistory)
+            db.query(PlayHistory.song_id, PlayHistory.played_at)
             .filter(PlayHistory.user_id == user_id)
             .order_by(PlayHistory.played_at)
             .all()
@@ -205,117 +392,98 @@ class RecommendationEngine:
         if len(user_plays) < 2:
             return scores
         
-        # Build co-occurrence matrix (songs played close together in time)
-        co_occurrence = defaultdict(Counter)
-        window_hours = 2  # Consider songs played within 2 hours as related
-        
-        for i, play in enumerate(user_plays):
-            # Look at songs played within time window
-            for j in range(i + 1, len(user_plays)):
-                other_play = user_plays[j]
-                time_diff = (other_play.played_at - play.played_at).total_seconds() / 3600
-                
-                if time_diff > window_hours:
-                    break
-                
-                # Increment co-occurrence count
-                co_occurrence[play.song_id][other_play.song_id] += 1
-                co_occurrence[other_play.song_id][play.song_id] += 1
-        
-        # Calculate scores based on co-occurrence with recently played songs
-        recent_plays = user_plays[-20:]  # Last 20 songs
-        recent_song_ids = [p.song_id for p in recent_plays]
-        
-        for song in candidate_songs:
-            # Sum co-occurrence scores with recently played songs
-            total_cooccur = sum(
-                co_occurrence[recent_id].get(song.id, 0) 
-                for recent_id in recent_song_ids
-            )
-            
-            # Normalize by number of recent songs
-            if recent_song_ids:
-                scores[song.id] = min(total_cooccur / len(recent_song_ids), 1.0)
+        window = timedelta(hours=2)  # Consider songs played within 2 hours as related
+        n_plays = len(user_plays)
+        
+        # Integer microseconds since the first play keep the window test exact
+        first_played_at = user_plays[0].played_at
+        timestamps = np.fromiter(
+            ((played_at - first_played_at) // _ONE_MICROSECOND for _, played_at in user_plays),
+            dtype=np.int64, count=n_plays,
+        )
+        # Sliding window: plays i+1 .. window_ends[i]-1 fall within the window of play i
+        window_ends = np.searchsorted(timestamps, timestamps + window // _ONE_MICROSECOND, side="right")
+        
+        # Map song ids to matrix indices 0..K-1
+        play_song_ids = np.fromiter((song_id for song_id, _ in user_plays), dtype=np.int64, count=n_plays)
+        song_index_ids, play_idx = np.unique(play_song_ids, return_inverse=True)
+        n_songs = len(song_index_ids)
+        
+        # Expand every in-window pair of plays (i, j), i < j
+        pair_counts = window_ends - np.arange(n_plays) - 1
+        first = np.repeat(np.arange(n_plays), pair_counts)
+        pair_starts = np.cumsum(pair_counts) - pair_counts
+        second = first + 1 + np.arange(pair_counts.sum()) - np.repeat(pair_starts, pair_counts)
+        
+        # Build co-occurrence matrix (songs played close together in time);
+        # each pair counts in both directions and duplicates are summed
+        rows = np.concatenate((play_idx[first], play_idx[second]))
+        cols = np.concatenate((play_idx[second], play_idx[first]))
+        co_occurrence = coo_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(n_songs, n_songs)
+        ).tocsr()
+        
+        # Calculate scores based on co-occurrence with recently played songs,
+        # normalized by the number of recent songs
+        recent_idx = play_idx[-20:]  # Last 20 songs
+        totals = np.asarray(co_occurrence[recent_idx].sum(axis=0)).ravel()
+        song_scores = np.minimum(totals / len(recent_idx), 1.0)
+        
+        candidate_ids = np.fromiter((song.id for song in candidate_songs), dtype=np.int64, count=len(candidate_songs))
+        positions = np.minimum(np.searchsorted(song_index_ids, candidate_ids), n_songs - 1)
+        played = song_index_ids[positions] == candidate_ids
+        for song_id, position in zip(candidate_ids[played].tolist(), positions[played].tolist()):
+            scores[song_id] = float(song_scores[position])
         
         return scores
     
-    def _calculate_audio_similarity(self, song: Song, reference_songs: List[Song]) -> float:
-        """
-        Calculate similarity between song and reference songs based on audio features.
-        Uses BPM, energy, and other features if available.
-        Enhanced to work better with limited data.
-        """
-        # If no features available, return neutral score
-        if not song.bpm and not song.energy and not song.year:
-            return 0.5
-        
-        similarities = []
-        
-        for ref_song in reference_songs:
-            similarity_components = []
-            
-            # BPM similarity (tempo matching)
-            if song.bpm and ref_song.bpm:
-                # Use BPM range matching (songs within 20 BPM are similar)
-                bpm_diff = abs(song.bpm - ref_song.bpm)
-                bpm_sim = max(0, 1.0 - (bpm_diff / 40.0))  # 40 BPM range
-                similarity_components.append(bpm_sim)
-            
-            # Year similarity (era matching)
-            if song.year and ref_song.year:
-                # Songs from similar years are similar (5 year range)
-                year_diff = abs(song.year - ref_song.year)
-                year_sim = max(0, 1.0 - (year_diff / 10.0))  # 10 year range
-                similarity_components.append(year_sim * 0.6)  # Lower weight
-            
-            # Duration similarity
-            if song.duration and ref_song.duration:
-                # Similar length songs
-                duration_diff = abs(song.duration - ref_song.duration)
-                duration_sim = max(0, 1.0 - (duration_diff / 300.0))  # 5 min range
-                similarity_components.append(duration_sim * 0.4)  # Even lower weight
-            
-            # Energy and other audio features
-            if song.energy and ref_song.energy:
-                energy_diff = abs(song.energy - ref_song.energy)
-                energy_sim = max(0, 1.0 - energy_diff)
-                similarity_components.append(energy_sim)
-            
-            if song.danceability and ref_song.danceability:
-                dance_diff = abs(song.danceability - ref_song.danceability)
-                dance_sim = max(0, 1.0 - dance_diff)
-                similarity_components.append(dance_sim)
-            
-            if song.valence and ref_song.valence:
-                valence_diff = abs(song.valence - ref_song.valence)
-                valence_sim = max(0, 1.0 - valence_diff)
-                similarity_components.append(valence_sim)
-            
-            if song.acousticness and ref_song.acousticness:
-                acoustic_diff = abs(song.acousticness - ref_song.acousticness)
-                acoustic_sim = max(0, 1.0 - acoustic_diff)
-                similarity_components.append(acoustic_sim)
-            
-            # Average the available components
-            if similarity_components:
-                similarities.append(np.mean(similarity_components))
-        
-        # Return average similarity, or 0.5 if no valid comparisons
-        return np.mean(similarities) if similarities else 0.5
+    def _get_recently_played_ids(self, db: Session, user_id: int, hours: int) -> frozenset:
+        """Songs the user played within the last `hours`, cached for a minute."""
+        now = time.monotonic()
+        cached = self._recent_plays_cache.get(user_id)
+        if cached is not None and cached[1] == hours and now - cached[0] < RECENT_PLAYS_CACHE_TTL_SECONDS:
+            return cached[2]
+        
+        recent_cutoff = datetime.utcnow() - timedelta(hours=hours)
+        song_ids = frozenset(
+            song_id for (song_id,) in
+            db.query(PlayHistory.song_id)
+            .filter(PlayHistory.user_id == user_id, PlayHistory.played_at >= recent_cutoff)
+            .distinct()
+        )
+        if len(self._recent_plays_cache) >= RECENT_PLAYS_CACHE_MAX_SIZE:
+            self._recent_plays_cache.clear()
+        self._recent_plays_cache[user_id] = (now, hours, song_ids)
+        return song_ids
     
-    def _calculate_popularity_score(self, song: Song) -> float:
-        """Calculate popularity score based on play count (10% weight from requirements)."""
-        if not song.play_count:
-            return 0.0
-        
-        # Get max play count for normalization
-        max_plays = self.db.query(func.max(Song.play_count)).scalar() or 1
-        return min(song.play_count / max_plays, 1.0)
+    def _get_max_plays(self, db: Session) -> int:
+        """Highest play count in the library (1 when nothing has been played), cached for a minute."""
+        now = time.monotonic()
+        cached = self._max_plays_cache
+        if cached is not None and now - cached[0] < MAX_PLAYS_CACHE_TTL_SECONDS:
+            return cached[1]
+        
+        max_plays = db.query(func.max(Song.play_count)).scalar() or 1
+        self._max_plays_cache = (now, max_plays)
+        return max_plays
     
-    def _generate_reason(self, song: Song, content_score: float, collab_score: float, user_id: int) -> str:
-        """Generate human-readable recommendation reason."""
+    def invalidate_play_caches(self, user_id: int) -> None:
+        """Drop cached play data after a new play by the user is recorded."""
+        self._recent_plays_cache.pop(user_id, None)
+        self._max_plays_cache = None
+    
+    def _calculate_popularity_scores(self, songs: List[Song], max_plays: int) -> np.ndarray:
+        """Calculate popularity scores based on play count (10% weight from requirements)."""
+        play_counts = np.fromiter((song.play_count or 0 for song in songs), dtype=np.float64, count=len(songs))
+        return np.minimum(play_counts / max_plays, 1.0)
+    
+    def _precompute_reason_context(self, db: Session, user_id: int) -> Optional[ReasonContext]:
+        """
+        Summarize the songs behind the user's last 20 completed plays.
+        Returns None when the user has no completed plays.
+        """
         user_history = (
-            self.db.query(PlayHistory)
+            db.query(PlayHistory.song_id)
             .filter(PlayHistory.user_id == user_id, PlayHistory.completed == True)
             .order_by(desc(PlayHistory.played_at))
             .limit(20)
@@ -323,42 +491,52 @@ class RecommendationEngine:
         )
         
         if not user_history:
-            return "Discover something new"
+            return None
         
-        recent_songs = self.db.query(Song).filter(
-            Song.id.in_([ph.song_id for ph in user_history])
+        recent_songs = db.query(Song).filter(
+            Song.id.in_([song_id for (song_id,) in user_history])
         ).all()
         
+        bpms = [s.bpm for s in recent_songs if s.bpm]
+        return ReasonContext(
+            artist_counts=Counter(_norm(s.artist) for s in recent_songs if s.artist),
+            genre_counts=Counter(_norm(s.genre) for s in recent_songs if s.genre),
+            album_set={_norm(s.album) for s in recent_songs if s.album},
+            avg_bpm=sum(bpms) / len(bpms) if bpms else None,
+        )
+    
+    def _generate_reason(
+        self, song: Song, content_score: float, collab_score: float, ctx: Optional[ReasonContext]
+    ) -> str:
+        """Generate human-readable recommendation reason."""
+        if ctx is None:
+            return "Discover something new"
+        
         if content_score > collab_score * 1.3:  # Clearly content-driven
             # Check for exact artist match
-            user_artists = [s.artist.lower().strip() for s in recent_songs if s.artist]
-            if song.artist and song.artist.lower().strip() in user_artists:
+            if song.artist:
                 # Count how many times user played this artist
-                artist_plays = sum(1 for s in recent_songs if s.artist and s.artist.lower().strip() == song.artist.lower().strip())
+                artist_plays = ctx.artist_counts[_norm(song.artist)]
                 if artist_plays >= 3:
                     return f"You love {song.artist}"
-                else:
+                elif artist_plays:
                     return f"More from {song.artist}"
             
             # Check for genre match
-            user_genres = [s.genre.lower().strip() for s in recent_songs if s.genre]
-            if song.genre and song.genre.lower().strip() in user_genres:
-                genre_plays = sum(1 for s in recent_songs if s.genre and s.genre.lower().strip() == song.genre.lower().strip())
+            if song.genre:
+                genre_plays = ctx.genre_counts[_norm(song.genre)]
                 if genre_plays >= 5:
                     return f"Your favorite: {song.genre}"
-                else:
+                elif genre_plays:
                     return f"Similar to your {song.genre} tracks"
             
             # Check for album match
-            user_albums = [s.album.lower().strip() for s in recent_songs if s.album]
-            if song.album and song.album.lower().strip() in user_albums:
+            if song.album and _norm(song.album) in ctx.album_set:
                 return f"From an album you enjoy"
             
             # BPM/tempo match
-            if song.bpm:
-                avg_bpm = np.mean([s.bpm for s in recent_songs if s.bpm])
-                if not np.isnan(avg_bpm) and abs(song.bpm - avg_bpm) < 15:
-                    return "Matches your tempo preference"
+            if song.bpm and ctx.avg_bpm is not None and abs(song.bpm - ctx.avg_bpm) < 15:
+                return "Matches your tempo preference"
             
             return "Based on your taste"
         elif collab_score > 0.1:  # Collaborative signal
@@ -369,27 +547,87 @@ class RecommendationEngine:
                 return "Trending track"
             return "Recommended for you"
     
-    def get_similar_songs(self, song_id: int, limit: int = 10) -> List[Tuple[Song, float, str]]:
+    def get_similar_songs(self, db: Session, song_id: int, limit: int = 10) -> List[Tuple[Song, float, str]]:
         """
         Get songs similar to a specific song (content-based only).
         Enhanced with better matching criteria.
         """
-        reference_song = self.db.query(Song).filter(Song.id == song_id).first()
+        reference_song = db.get(Song, song_id)
         if not reference_song:
             return []
         
-        # Get all other songs
-        all_songs = self.db.query(Song).filter(Song.id != song_id).all()
+        # Score only songs sharing an artist, genre or album first; every other
+        # song can reach at most the audio-only score
+        scores = self._score_similar_songs(reference_song, self._related_songs(db, reference_song))
+        # Top N by a bounded heap (ties keep song order, like a stable sort)
+        top_scores = heapq.nlargest(limit, scores, key=lambda x: x[1])
+        
+        if len(top_scores) < limit or (top_scores and top_scores[-1][1] <= _MAX_AUDIO_ONLY_SIMILARITY):
+            # Shortlist can't fill the top N on its own, score all other songs
+            all_songs = db.query(Song).filter(Song.id != song_id).order_by(Song.id).all()
+            scores = self._score_similar_songs(reference_song, all_songs)
+            top_scores = heapq.nlargest(limit, scores, key=lambda x: x[1])
+        
+        # Filter out very low scores (< 0.1) to ensure quality
+        return [(s, score, r) for s, score, r in top_scores if score >= 0.1]
+    
+    def _related_songs(self, db: Session, reference_song: Song) -> List[Song]:
+        """
+        Songs (other than the reference) whose artist, genre or album matches the
+        reference the way _score_similar_songs does.
+        
+        Matching runs in Python over the distinct column values, so it agrees
+        with the Unicode-aware normalization; the songs are then fetched through
+        the indexed columns.
+        """
+        conditions = []
+        if reference_song.artist:
+            ref_artist = _norm(reference_song.artist)
+            artists = [
+                artist for (artist,) in db.query(Song.artist).distinct()
+                if artist and (ref_artist in _norm(artist) or _norm(artist) in ref_artist)
+            ]
+            conditions.append(Song.artist.in_(artists))
+        if reference_song.genre:
+            ref_genre = _norm(reference_song.genre)
+            genres = [
+                genre for (genre,) in db.query(Song.genre).distinct()
+                if genre and (ref_genre in _norm(genre) or _norm(genre) in ref_genre)
+            ]
+            conditions.append(Song.genre.in_(genres))
+        if reference_song.album:
+            ref_album = _norm(reference_song.album)
+            albums = [
+                album for (album,) in db.query(Song.album).distinct()
+                if album and _norm(album) == ref_album
+            ]
+            conditions.append(Song.album.in_(albums))
+        
+        if not conditions:
+            return []
+        return (
+            db.query(Song)
+            .filter(Song.id != reference_song.id, or_(*conditions))
+            .order_by(Song.id)
+            .all()
+        )
+    
+    def _score_similar_songs(self, reference_song: Song, songs: List[Song]) -> List[Tuple[Song, float, str]]:
+        """Similarity score and reason of each song to the reference song, in input order."""
+        # Audio features similarity against the single reference, one vector pass
+        cand_values, cand_mask = _audio_feature_matrix(songs)
+        ref_values, ref_mask = _audio_feature_matrix([reference_song])
+        audio_scores = _batch_audio_similarity(cand_values, cand_mask, ref_values, ref_mask)
         
         scores = []
-        for song in all_songs:
+        for song, audio_score in zip(songs, audio_scores.tolist()):
             similarity_score = 0.0
             reason_parts = []
             
             # Artist match (35%) - highest weight for same artist
             if song.artist and reference_song.artist:
-                song_artist = song.artist.lower().strip()
-                ref_artist = reference_song.artist.lower().strip()
+                song_artist = _norm(song.artist)
+                ref_artist = _norm(reference_song.artist)
                 if song_artist == ref_artist:
                     similarity_score += 0.35
                     reason_parts.append(f"More from {song.artist}")
@@ -399,8 +637,8 @@ class RecommendationEngine:
             
             # Genre match (30%)
             if song.genre and reference_song.genre:
-                song_genre = song.genre.lower().strip()
-                ref_genre = reference_song.genre.lower().strip()
+                song_genre = _norm(song.genre)
+                ref_genre = _norm(reference_song.genre)
                 if song_genre == ref_genre:
                     similarity_score += 0.30
                     reason_parts.append(f"Similar {song.genre}")
@@ -410,12 +648,11 @@ class RecommendationEngine:
             
             # Album match (15%) - songs from same album are very similar
             if song.album and reference_song.album:
-                if song.album.lower().strip() == reference_song.album.lower().strip():
+                if _norm(song.album) == _norm(reference_song.album):
                     similarity_score += 0.15
                     reason_parts.append("Same album")
             
             # Audio features similarity (20%)
-            audio_score = self._calculate_audio_similarity(song, [reference_song])
             similarity_score += 0.20 * audio_score
             
             # Generate reason
@@ -426,29 +663,21 @@ class RecommendationEngine:
             
             scores.append((song, similarity_score, reason))
         
-        # Sort by similarity and return top N
-        scores.sort(key=lambda x: x[1], reverse=True)
-        
-        # Filter out very low scores (< 0.1) to ensure quality
-        filtered_scores = [(s, score, r) for s, score, r in scores if score >= 0.1]
-        
-        return filtered_scores[:limit]
+        return scores
     
-    def get_trending_songs(self, limit: int = 20, days: int = 7) -> List[Song]:
+    def get_trending_songs(self, db: Session, limit: int = 20, days: int = 7) -> List[Song]:
         """
         Get trending songs based on recent play counts.
         """
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         
-        # Count plays in the time window
+        # Count plays in the time window, joined to the songs in one query
         trending = (
-            self.db.query(
-                PlayHistory.song_id,
-                func.count(PlayHistory.id).label("play_count")
-            )
+            db.query(Song)
+            .join(PlayHistory, PlayHistory.song_id == Song.id)
             .filter(PlayHistory.played_at >= cutoff_date)
-            .group_by(PlayHistory.song_id)
-            .order_by(desc("play_count"))
+            .group_by(Song.id)
+            .order_by(desc(func.count(PlayHistory.id)), Song.id)
             .limit(limit)
             .all()
         )
@@ -456,38 +685,52 @@ class RecommendationEngine:
         if not trending:
             # Fallback to most played songs overall
             return (
-                self.db.query(Song)
+                db.query(Song)
                 .order_by(desc(Song.play_count))
                 .limit(limit)
                 .all()
             )
         
-        song_ids = [t.song_id for t in trending]
-        songs = self.db.query(Song).filter(Song.id.in_(song_ids)).all()
-        
-        # Preserve order from trending query
-        song_map = {s.id: s for s in songs}
-        return [song_map[sid] for sid in song_ids if sid in song_map]
+        return trending
+
+
+def _top_listened(db: Session, user_id: int, column, limit: int = 5) -> List[Tuple[str, int]]:
+    """
+    Most played values of a Song column over the user's completed plays.
+    
+    Ties keep the order in which values were first played.
+    """
+    play_count = func.count(PlayHistory.id)
+    return [
+        (value, count) for value, count in
+        db.query(column, play_count)
+        .join(PlayHistory, PlayHistory.song_id == Song.id)
+        .filter(
+            PlayHistory.user_id == user_id,
+            PlayHistory.completed == True,
+            column.isnot(None),
+            column != "",
+        )
+        .group_by(column)
+        .order_by(desc(play_count), func.min(PlayHistory.id))
+        .limit(limit)
+    ]
 
 
 def get_user_listening_stats(db: Session, user_id: int) -> Dict:
     """
     Get user listening statistics for display.
     """
-    # Total completed plays only
-    total_plays = db.query(func.count(PlayHistory.id)).filter(
+    # Total completed plays and listening time in one aggregate query
+    total_plays, total_listening_time = db.query(
+        func.count(PlayHistory.id),
+        func.coalesce(func.sum(PlayHistory.listen_duration), 0),
+    ).filter(
         PlayHistory.user_id == user_id,
         PlayHistory.completed == True
-    ).scalar()
-    
-    # Get completed play history
-    user_plays = (
-        db.query(PlayHistory)
-        .filter(PlayHistory.user_id == user_id, PlayHistory.completed == True)
-        .all()
-    )
+    ).one()
     
-    if not user_plays:
+    if not total_plays:
         return {
             "total_plays": 0,
             "favorite_genres": [],
@@ -495,25 +738,10 @@ def get_user_listening_stats(db: Session, user_id: int) -> Dict:
             "total_listening_time": 0,
         }
     
-    song_ids = [p.song_id for p in user_plays]
-    songs = db.query(Song).filter(Song.id.in_(song_ids)).all()
-    song_map = {s.id: s for s in songs}
-    
-    # Count genres and artists from completed plays
-    genre_counts = Counter()
-    artist_counts = Counter()
-    
-    for play in user_plays:
-        song = song_map.get(play.song_id)
-        if song:
-            if song.genre:
-                genre_counts[song.genre] += 1
-            if song.artist:
-                artist_counts[song.artist] += 1
-    
+    # Count genres and artists from completed plays, aggregated in SQL
     return {
-        "total_plays": total_plays or 0,
-        "favorite_genres": [{"genre": g, "count": c} for g, c in genre_counts.most_common(5)],
-        "favorite_artists": [{"artist": a, "count": c} for a, c in artist_counts.most_common(5)],
-        "total_listening_time": sum(p.listen_duration for p in user_plays if p.listen_duration),
+        "total_plays": total_plays,
+        "favorite_genres": [{"genre": g, "count": c} for g, c in _top_listened(db, user_id, Song.genre)],
+        "favorite_artists": [{"artist": a, "count": c} for a, c in _top_listened(db, user_id, Song.artist)],
+        "total_listening_time": total_listening_time,
     }
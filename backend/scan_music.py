@@ -1,13 +1,22 @@
+import asyncio
 import os
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
 from mutagen.mp3 import MP3
 from sqlalchemy.orm import Session
 
+from .database import SessionLocal
 from .models import Song
 
 PROJECT_ROOT = pathlib.Path(__file__).parent.parent
 MUSIC_DIR = PROJECT_ROOT / "music"
 SUPPORTED_EXTENSIONS = {".mp3"}
+# Files handed to each metadata worker at a time
+METADATA_CHUNK_SIZE = 32
+# New songs added to the session per flush
+INSERT_BATCH_SIZE = 500
+# Metadata reads in flight at once in the async scan
+ASYNC_METADATA_CONCURRENCY = 32
 
 
 def get_metadata(file_path: pathlib.Path) -> dict | None:
@@ -60,24 +69,75 @@ def get_metadata(file_path: pathlib.Path) -> dict | None:
         print(f"Error reading metadata for {file_path}: {e}")
         return None
 
-def scan_music_library(db: Session):
-    """Scans the music directory and adds new songs to the database."""
+def _find_new_files(db: Session) -> list[pathlib.Path] | None:
+    """Lists supported files not yet in the database, or None if the music directory is missing."""
     print(f"Scanning directory: {MUSIC_DIR}")
     if not MUSIC_DIR.exists():
         print(f"Directory not found: {MUSIC_DIR}")
         print("Please create a 'music' folder in the project root and add your MP3 files.")
-        return
+        return None
 
-    for file_path in MUSIC_DIR.rglob("*"):
-        if file_path.suffix.lower() in SUPPORTED_EXTENSIONS:
-            if not db.query(Song).filter(Song.file_path == str(file_path)).first():
-                try:
-                    meta = get_metadata(file_path)
-                    if meta:
-                        song = Song(**meta)
-                        db.add(song)
-                        print(f"Adding: {meta.get('artist', 'Unknown Artist')} - {meta.get('title', 'Unknown Title')}")
-                except Exception as e:
-                    print(f"Error processing {file_path}: {e}")
+    # One query for every known path instead of one per file
+    existing = {file_path for (file_path,) in db.query(Song.file_path)}
+    return [
+        file_path for file_path in MUSIC_DIR.rglob("*")
+        if file_path.suffix.lower() in SUPPORTED_EXTENSIONS
+        and str(file_path) not in existing
+    ]
+
+
+def _add_songs(db: Session, metas: list[dict | None]):
+    """Adds the songs for the extracted metadata in batches and commits."""
+    batch = []
+    for meta in metas:
+        if meta:
+            batch.append(Song(**meta))
+            print(f"Adding: {meta.get('artist', 'Unknown Artist')} - {meta.get('title', 'Unknown Title')}")
+            if len(batch) >= INSERT_BATCH_SIZE:
+                db.add_all(batch)
+                db.flush()
+                batch = []
+    db.add_all(batch)
     db.commit()
     print("Scan complete.")
+
+
+def scan_music_library(db: Session):
+    """Scans the music directory and adds new songs to the database."""
+    new_paths = _find_new_files(db)
+    if new_paths is None:
+        return
+
+    # Tag parsing is CPU-bound and independent per file, so fan it out across cores
+    if new_paths:
+        with ProcessPoolExecutor() as executor:
+            metas = list(executor.map(get_metadata, new_paths, chunksize=METADATA_CHUNK_SIZE))
+    else:
+        metas = []
+
+    _add_songs(db, metas)
+
+
+async def scan_music_library_async(db: Session):
+    """Scans the music library from async code without blocking the event loop on file reads."""
+    new_paths = await asyncio.to_thread(_find_new_files, db)
+    if new_paths is None:
+        return
+
+    semaphore = asyncio.Semaphore(ASYNC_METADATA_CONCURRENCY)
+
+    async def read_metadata(file_path: pathlib.Path) -> dict | None:
+        async with semaphore:
+            return await asyncio.to_thread(get_metadata, file_path)
+
+    metas = await asyncio.gather(*(read_metadata(file_path) for file_path in new_paths))
+    await asyncio.to_thread(_add_songs, db, metas)
+
+
+def run_scan():
+    """Scans the music library with its own session, for use from a (spawned) worker process."""
+    db = SessionLocal()
+    try:
+        scan_music_library(db)
+    finally:
+        db.close()
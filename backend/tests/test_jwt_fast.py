@@ -0,0 +1,112 @@
+import hmac
+import time
+from hashlib import sha256
+
+import orjson
+import pytest
+
+from backend.jwt_fast import (
+    InvalidTokenError,
+    _b64encode,
+    decode_hs256,
+    encode_hs256,
+    encode_hs256_subject,
+)
+
+KEY = b"test-secret"
+
+
+def _future_exp() -> int:
+    return int(time.time()) + 600
+
+
+def _token(header: dict, claims: dict, key: bytes = KEY, signature: bytes | None = None) -> str:
+    """Build a token from arbitrary header/claims, signed with `key` unless a signature is given."""
+    signing_input = _b64encode(orjson.dumps(header)) + b"." + _b64encode(orjson.dumps(claims))
+    if signature is None:
+        signature = _b64encode(hmac.new(key, signing_input, sha256).digest())
+    return (signing_input + b"." + signature).decode()
+
+
+def test_round_trip():
+    claims = {"sub": "alice", "exp": _future_exp(), "role": "admin"}
+    assert decode_hs256(encode_hs256(claims, KEY), KEY) == claims
+
+
+def test_wrong_key_is_rejected():
+    token = encode_hs256({"sub": "alice", "exp": _future_exp()}, KEY)
+    with pytest.raises(InvalidTokenError):
+        decode_hs256(token, b"other-secret")
+
+
+def test_tampered_signature_is_rejected():
+    token = encode_hs256({"sub": "alice", "exp": _future_exp()}, KEY)
+    head, _, signature = token.rpartition(".")
+    tampered = head + "." + ("A" if signature[0] != "A" else "B") + signature[1:]
+    with pytest.raises(InvalidTokenError):
+        decode_hs256(tampered, KEY)
+
+
+def test_tampered_payload_is_rejected():
+    token = encode_hs256({"sub": "alice", "exp": _future_exp()}, KEY)
+    header, _, rest = token.partition(".")
+    _, _, signature = rest.partition(".")
+    forged = _b64encode(orjson.dumps({"sub": "admin", "exp": _future_exp()})).decode()
+    with pytest.raises(InvalidTokenError):
+        decode_hs256(f"{header}.{forged}.{signature}", KEY)
+
+
+def test_alg_none_is_rejected():
+    token = _token({"alg": "none", "typ": "JWT"}, {"sub": "alice", "exp": _future_exp()}, signature=b"")
+    with pytest.raises(InvalidTokenError):
+        decode_hs256(token, KEY)
+
+
+@pytest.mark.parametrize("token", ["", ".", "..", "eyJhbGciOiJIUzI1NiJ9", "eyJhbGciOiJIUzI1NiJ9.", "a.b", "a.b.c.d"])
+def test_malformed_tokens_are_rejected(token):
+    with pytest.raises(InvalidTokenError):
+        decode_hs256(token, KEY)
+
+
+def test_expired_token_is_rejected():
+    token = encode_hs256({"sub": "alice", "exp": int(time.time()) - 1}, KEY)
+    with pytest.raises(InvalidTokenError, match="expired"):
+        decode_hs256(token, KEY)
+
+
+@pytest.mark.parametrize("exp", ["9999999999", None, [1], {"t": 1}])
+def test_non_numeric_exp_is_rejected(exp):
+    token = _token({"alg": "HS256", "typ": "JWT"}, {"sub": "alice", "exp": exp})
+    if exp is None:
+        # A null exp is treated like a missing one
+        assert decode_hs256(token, KEY)["sub"] == "alice"
+        return
+    with pytest.raises(InvalidTokenError, match="exp"):
+        decode_hs256(token, KEY)
+
+
+def test_non_object_claims_are_rejected():
+    token = _token({"alg": "HS256", "typ": "JWT"}, ["sub", "alice"])
+    with pytest.raises(InvalidTokenError):
+        decode_hs256(token, KEY)
+
+
+@pytest.mark.parametrize("token", ["é.é.é", "eyJhbGciOiJIUzI1NiJ9.eyJzdWIiOiJhIn0.sïg", "\u0000.\u0000.\u0000"])
+def test_non_ascii_tokens_are_rejected(token):
+    with pytest.raises(InvalidTokenError):
+        decode_hs256(token, KEY)
+
+
+@pytest.mark.parametrize("sub", ["alice", "user_42", "Đen Vâu", "名前", "a b/c'd", ""])
+def test_subject_fast_path_matches_generic_encoder(sub):
+    exp = _future_exp()
+    token = encode_hs256_subject(sub, exp, KEY)
+    assert token == encode_hs256({"sub": sub, "exp": exp}, KEY)
+    assert decode_hs256(token, KEY) == {"sub": sub, "exp": exp}
+
+
+@pytest.mark.parametrize("sub", ['quote"', "back\\slash", "new\nline", "tab\t", "\x7f"])
+def test_subject_fast_path_declines_strings_needing_escapes(sub):
+    exp = _future_exp()
+    assert encode_hs256_subject(sub, exp, KEY) is None
+    assert decode_hs256(encode_hs256({"sub": sub, "exp": exp}, KEY), KEY)["sub"] == sub
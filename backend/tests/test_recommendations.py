@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from backend import recommendations
+
+
+def _random_features(rng, n_songs):
+    """Feature matrix in the _audio_feature_matrix layout, with ~40% of values missing."""
+    values = rng.uniform(0, 1, (n_songs, len(recommendations._AUDIO_FEATURES)))
+    values *= np.array([180, 2024, 400, 1, 1, 1, 1])
+    values[rng.random(values.shape) < 0.4] = 0
+    return values.astype(np.float32), values != 0
+
+
+def test_numba_kernel_matches_numpy_path(monkeypatch):
+    pytest.importorskip("numba")
+    assert recommendations.njit is not None
+    rng = np.random.default_rng(0)
+    for n_cand, n_ref in [(0, 5), (1, 1), (50, 0), (200, 30), (1000, 3)]:
+        cand = _random_features(rng, n_cand)
+        ref = _random_features(rng, n_ref)
+        compiled = recommendations._batch_audio_similarity(*cand, *ref)
+        with monkeypatch.context() as m:
+            m.setattr(recommendations, "njit", None)
+            vectorized = recommendations._batch_audio_similarity(*cand, *ref)
+        np.testing.assert_allclose(compiled, vectorized, rtol=0, atol=1e-6)